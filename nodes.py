@@ -1,6 +1,8 @@
 import os
 import re
 import yaml
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pocketflow import Node, BatchNode
 from utils.crawl_github_files import crawl_github_files
 from utils.crawl_gitlab_files import crawl_gitlab_files
@@ -331,22 +333,17 @@ IMPORTANT: Use terminology and concepts from the project documentation above whe
 The project's actual purpose and domain should guide your abstraction identification.
 """
 
-        prompt = f"""
+        # Static instructions go in the cache prefix; the codebase context follows as the prompt
+        cache_prefix = f"""
 For the project `{project_name}`:
 {project_docs_section}
-Codebase Context:
-{context}
-
-{language_instruction}Analyze the codebase context.
+{language_instruction}Analyze the codebase context provided after these instructions.
 Identify the top 5-{max_abstraction_num} core most important abstractions to help those new to the codebase.
 
 For each abstraction, provide:
 1. A concise `name`{name_lang_hint}.
 2. A beginner-friendly `description` explaining what it is with a simple analogy, in around 100 words{desc_lang_hint}.
-3. A list of relevant `file_indices` (integers) using the format `idx # path/comment`.
-
-List of file indices and paths present in the context:
-{file_listing_for_prompt}
+3. A list of relevant `file_indices` (integers) using the format `idx # path/comment`, taken from the list of file indices and paths given with the context.
 
 CRITICAL: You MUST output ONLY valid YAML format. Do NOT include any explanatory text before or after the YAML block. Start directly with the YAML code block.
 
@@ -373,7 +370,16 @@ Format the output as a YAML list of dictionaries (note: it starts with a dash "-
 ```
 
 IMPORTANT: Output ONLY the YAML block above. Do not add any text before or after it."""
-        response = call_llm(prompt, use_cache=(use_cache and self.cur_retry == 0))  # Use cache only if enabled and not retrying
+
+        prompt = f"""
+Codebase Context:
+{context}
+
+List of file indices and paths present in the context:
+{file_listing_for_prompt}
+
+Now, provide the YAML output:"""
+        response = call_llm(prompt, use_cache=(use_cache and self.cur_retry == 0), cache_prefix=cache_prefix)  # Use cache only if enabled and not retrying
 
         # --- Validation ---
         yaml_str = extract_yaml_from_response(response, "IdentifyAbstractions response")
@@ -474,7 +480,29 @@ class IdentifyAbstractionsMap(BatchNode):
     """
     Map phase: Splits files into chunks and identifies abstractions in each chunk.
     This allows processing repositories of any size by analyzing files in groups.
+    Chunks are independent and I/O-bound on the LLM API, so they run concurrently
+    (LLM_CONCURRENCY threads, default 8).
     """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Node._exec keeps the retry counter on self; keep it per-thread so each chunk retries independently
+        self._retry_state = threading.local()
+
+    @property
+    def cur_retry(self):
+        return getattr(self._retry_state, "cur_retry", 0)
+
+    @cur_retry.setter
+    def cur_retry(self, value):
+        self._retry_state.cur_retry = value
+
+    def _exec(self, items):
+        max_workers = int(os.getenv("LLM_CONCURRENCY", "8"))
+        node_exec = super(BatchNode, self)._exec  # Per-item retry loop from Node
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # executor.map keeps results in chunk order, as the sequential BatchNode did
+            return list(executor.map(node_exec, items or []))
+
     def prep(self, shared):
         files_data = shared["files"]
         project_name = shared["project_name"]
@@ -577,22 +605,18 @@ IMPORTANT: Use terminology and concepts from the project documentation above whe
         # Prompt for this chunk - ask for 3-5 abstractions per chunk
         abstractions_per_chunk = min(5, max(3, max_abstraction_num // 2))  # 3-5 per chunk
         
-        prompt = f"""
+        # The instructions are identical for every chunk, so they go in the cache prefix
+        cache_prefix = f"""
 For the project `{project_name}`:
 {project_docs_section}
-Codebase Context (subset of files {start_index} to {start_index + len(files_chunk) - 1} out of {total_files} total files):
-{context}
-
-{language_instruction}Analyze this subset of files from the codebase.
+{language_instruction}Analyze the subset of files from the codebase provided after these instructions.
 Identify {abstractions_per_chunk} core abstractions present in these specific files.
 
 For each abstraction, provide:
 1. A concise `name`{name_lang_hint}.
 2. A beginner-friendly `description` explaining what it is with a simple analogy, in around 100 words{desc_lang_hint}.
-3. A list of relevant `file_indices` (integers) from the list below using the format `idx # path/comment`.
-
-List of file indices and paths in this subset:
-{file_listing}
+3. A list of relevant `file_indices` (integers) using the format `idx # path/comment`, taken only from the list of file indices and paths in the subset.
+   Use the exact index numbers shown in that list; they do not necessarily start at 0.
 
 CRITICAL: You MUST output ONLY valid YAML format. Do NOT include any explanatory text before or after the YAML block.
 
@@ -606,20 +630,29 @@ Format the output as a YAML list of dictionaries:
   description: |
     Description of the abstraction{desc_lang_hint}
   file_indices:
-    - {start_index} # path/to/file1
-    - {start_index + 1} # path/to/file2
+    - <idx from the list> # path/to/file1
+    - <idx from the list> # path/to/file2
 - name: |
     Another Abstraction{name_lang_hint}
   description: |
     Another description{desc_lang_hint}
   file_indices:
-    - {start_index + 2} # path/to/file3
+    - <idx from the list> # path/to/file3
 ```
 
 IMPORTANT: Output ONLY the YAML block above. Do not add any text before or after it.
 Output exactly {abstractions_per_chunk} abstractions found in these files."""
+
+        prompt = f"""
+Codebase Context (subset of files {start_index} to {start_index + len(files_chunk) - 1} out of {total_files} total files):
+{context}
+
+List of file indices and paths in this subset:
+{file_listing}
+
+Now, provide the YAML output:"""
         
-        response = call_llm(prompt, use_cache=(use_cache and self.cur_retry == 0))
+        response = call_llm(prompt, use_cache=(use_cache and self.cur_retry == 0), cache_prefix=cache_prefix)
         
         # Validation
         yaml_str = extract_yaml_from_response(response, f"IdentifyAbstractionsMap chunk {start_index} response")
@@ -754,15 +787,12 @@ class IdentifyAbstractionsReduce(Node):
             # Convert to YAML for prompt
             abstractions_yaml = yaml.dump(all_abstractions, allow_unicode=True, default_flow_style=False)
             
-            prompt = f"""
+            cache_prefix = f"""
 For the project `{project_name}`:
 
-{language_instruction}You have analyzed a large codebase by processing it in chunks and identified {len(all_abstractions)} potential abstractions.
-
-All identified abstractions:
-{abstractions_yaml}
+{language_instruction}You have analyzed a large codebase by processing it in chunks and identified potential abstractions. They are listed after these instructions.
 
-Your task: Select the top {max_abstraction_num} MOST IMPORTANT and DISTINCT abstractions from the list above.
+Your task: Select the top {max_abstraction_num} MOST IMPORTANT and DISTINCT abstractions from that list.
 
 Requirements:
 1. Remove duplicates or very similar abstractions (merge them if needed)
@@ -792,8 +822,14 @@ The output MUST be a YAML list (array) of dictionaries. Format:
 ```
 
 IMPORTANT: Output ONLY the YAML block. Output exactly {max_abstraction_num} items."""
+
+            prompt = f"""
+All identified abstractions ({len(all_abstractions)} total):
+{abstractions_yaml}
+
+Now, provide the YAML output:"""
             
-            response = call_llm(prompt, use_cache=(use_cache and self.cur_retry == 0))
+            response = call_llm(prompt, use_cache=(use_cache and self.cur_retry == 0), cache_prefix=cache_prefix)
             yaml_str = extract_yaml_from_response(response, "IdentifyAbstractionsReduce response")
             
             try:
@@ -996,15 +1032,9 @@ CRITICAL: The project summary MUST reflect the actual purpose described in the p
 
 """
 
-        prompt = f"""
-Based on the following abstractions and relevant code snippets from the project `{project_name}`:
+        cache_prefix = f"""
+Based on the abstractions and relevant code snippets from the project `{project_name}` provided after these instructions:
 {project_docs_section}
-List of Abstraction Indices and Names{list_lang_note}:
-{abstraction_listing}
-
-Context (Abstractions, Descriptions, Code):
-{context}
-
 {language_instruction}Please provide:
 1. A high-level `summary` of the project's main purpose and functionality in a few beginner-friendly sentences{lang_hint}. Use markdown formatting with **bold** and *italic* text to highlight important concepts.
 2. A list (`relationships`) describing the key interactions between these abstractions. For each relationship, specify:
@@ -1031,10 +1061,18 @@ relationships:
     label: "Provides config"{lang_hint}
   # ... other relationships
 ```
+"""
+
+        prompt = f"""
+List of Abstraction Indices and Names{list_lang_note}:
+{abstraction_listing}
+
+Context (Abstractions, Descriptions, Code):
+{context}
 
 Now, provide the YAML output:
 """
-        response = call_llm(prompt, use_cache=(use_cache and self.cur_retry == 0)) # Use cache only if enabled and not retrying
+        response = call_llm(prompt, use_cache=(use_cache and self.cur_retry == 0), cache_prefix=cache_prefix) # Use cache only if enabled and not retrying
 
         # --- Validation ---
         yaml_str = extract_yaml_from_response(response, "AnalyzeRelationships response")
@@ -1153,14 +1191,8 @@ class OrderChapters(Node):
         print("Determining chapter order using LLM...")
         # No language variation needed here in prompt instructions, just ordering based on structure
         # The input names might be translated, hence the note.
-        prompt = f"""
-Given the following project abstractions and their relationships for the project ```` {project_name} ````:
-
-Abstractions (Index # Name){list_lang_note}:
-{abstraction_listing}
-
-Context about relationships and project summary:
-{context}
+        cache_prefix = f"""
+Given the project abstractions and their relationships for the project ```` {project_name} ```` provided after these instructions:
 
 If you are going to make a tutorial for ```` {project_name} ````, what is the best order to explain these abstractions, from first to last?
 Ideally, first explain those that are the most important or foundational, perhaps user-facing concepts or entry points. Then move to more detailed, lower-level implementation details or supporting concepts.
@@ -1173,10 +1205,18 @@ Output the ordered list of abstraction indices, including the name in a comment
 - 1 # CoreClassB (uses CoreClassA)
 - ...
 ```
+"""
+
+        prompt = f"""
+Abstractions (Index # Name){list_lang_note}:
+{abstraction_listing}
+
+Context about relationships and project summary:
+{context}
 
 Now, provide the YAML output:
 """
-        response = call_llm(prompt, use_cache=(use_cache and self.cur_retry == 0)) # Use cache only if enabled and not retrying
+        response = call_llm(prompt, use_cache=(use_cache and self.cur_retry == 0), cache_prefix=cache_prefix) # Use cache only if enabled and not retrying
 
         # --- Validation ---
         yaml_str = extract_yaml_from_response(response, "OrderChapters response")
@@ -1401,25 +1441,16 @@ Ensure all explanations align with the actual project purpose and use cases desc
 
 """
 
-        prompt = f"""
-{language_instruction}Write a very beginner-friendly tutorial chapter (in Markdown format) for the project `{project_name}` about the concept: "{abstraction_name}". This is Chapter {chapter_num}.
+        # Everything shared by all chapters goes in the cache prefix; the chapter-specific
+        # concept, previous-chapter summary and code snippets follow as the prompt
+        cache_prefix = f"""
+{language_instruction}Write a very beginner-friendly tutorial chapter (in Markdown format) for the project `{project_name}` about the concept given after these instructions.
 {project_docs_section}
-Concept Details{concept_details_note}:
-- Name: {abstraction_name}
-- Description:
-{abstraction_description}
-
 Complete Tutorial Structure{structure_note}:
 {item["full_chapter_listing"]}
 
-Context from previous chapters{prev_summary_note}:
-{previous_chapters_summary if previous_chapters_summary else "This is the first chapter."}
-
-Relevant Code Snippets (Code itself remains unchanged):
-{file_context_str if file_context_str else "No specific code snippets provided for this abstraction."}
-
 Instructions for the chapter (Generate content in {language.capitalize()} unless specified otherwise):
-- Start with a clear heading (e.g., `# Chapter {chapter_num}: {abstraction_name}`). Use the provided concept name.
+- Start with a clear heading (e.g., `# Chapter 1: Concept Name`) using the given chapter number and concept name.
 
 - If this is not the first chapter, begin with a brief transition from the previous chapter{instruction_lang_note}, referencing it with a proper Markdown link using its name{link_lang_note}.
 
@@ -1446,10 +1477,25 @@ Instructions for the chapter (Generate content in {language.capitalize()} unless
 - Ensure the tone is welcoming and easy for a newcomer to understand{tone_note}.
 
 - Output *only* the Markdown content for this chapter.
+"""
+
+        prompt = f"""
+This is Chapter {chapter_num}, about the concept: "{abstraction_name}".
+
+Concept Details{concept_details_note}:
+- Name: {abstraction_name}
+- Description:
+{abstraction_description}
+
+Context from previous chapters{prev_summary_note}:
+{previous_chapters_summary if previous_chapters_summary else "This is the first chapter."}
+
+Relevant Code Snippets (Code itself remains unchanged):
+{file_context_str if file_context_str else "No specific code snippets provided for this abstraction."}
 
 Now, directly provide a super beginner-friendly Markdown output (DON'T need ```markdown``` tags):
 """
-        chapter_content = call_llm(prompt, use_cache=(use_cache and self.cur_retry == 0)) # Use cache only if enabled and not retrying
+        chapter_content = call_llm(prompt, use_cache=(use_cache and self.cur_retry == 0), cache_prefix=cache_prefix) # Use cache only if enabled and not retrying
         # Basic validation/cleanup
         actual_heading = f"# Chapter {chapter_num}: {abstraction_name}"  # Use potentially translated name
         if not chapter_content.strip().startswith(f"# Chapter {chapter_num}"):
@@ -1,8 +1,35 @@
 from google import genai
+from google.genai import types
 import os
 import logging
 import json
+import sqlite3
+import hashlib
+import functools
+import threading
+import time
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory file locks
+    fcntl = None
+
+try:
+    import orjson
+except ImportError:  # Optional: falls back to the stdlib json module
+    orjson = None
+
+
+def _json_loads(data):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def _json_dumps(obj) -> bytes:
+    return orjson.dumps(obj) if orjson is not None else json.dumps(obj).encode("utf-8")
 
 # Configure logging
 log_directory = os.getenv("LOG_DIR", "logs")
@@ -21,164 +48,454 @@ file_handler.setFormatter(
 )
 logger.addHandler(file_handler)
 
-# Simple cache configuration
-cache_file = "llm_cache.json"
-
+# Simple cache configuration: SQLite keyed by SHA-256 of the prompt
+cache_file = "llm_cache.sqlite"
+_cache_lock = threading.Lock()
+_cache_conn = None
+
+
+def _get_cache_conn() -> sqlite3.Connection:
+    # Opened on first use (callers hold _cache_lock), so runs with caching off create no file
+    global _cache_conn
+    if _cache_conn is None:
+        conn = sqlite3.connect(cache_file, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS cache(key BLOB PRIMARY KEY, resp TEXT)")
+        conn.commit()
+        _cache_conn = conn
+    return _cache_conn
+
+
+def _cache_key(prompt: str, cache_prefix: Optional[str] = None) -> bytes:
+    # Prompts can be hundreds of KB, so only their 32-byte digest is ever stored or kept in memory.
+    # Hash incrementally rather than concatenating prefix and prompt into another large string.
+    h = hashlib.sha256()
+    if cache_prefix is not None:
+        h.update(cache_prefix.encode("utf-8"))
+        h.update(b"\0")
+    h.update(prompt.encode("utf-8"))
+    return h.digest()
+
+
+@functools.lru_cache(maxsize=4096)
+def _cache_get(key: bytes) -> str:
+    # Raise on miss so lru_cache only remembers hits
+    with _cache_lock:
+        row = _get_cache_conn().execute("SELECT resp FROM cache WHERE key=?", (key,)).fetchone()
+    if row is None:
+        raise KeyError(key)
+    return row[0]
+
+
+def _cache_put(key: bytes, response_text: str) -> None:
+    with _cache_lock:
+        conn = _get_cache_conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache(key, resp) VALUES (?, ?)", (key, response_text)
+        )
+        conn.commit()
+
+
+class SemanticCache:
+    """
+    Near-duplicate prompt cache on top of the exact-match cache.
+
+    Prompts are embedded with a sentence-transformers model and stored in a FAISS
+    inner-product index (embeddings are normalized, so scores are cosine similarity).
+    A lookup returns the response of the closest previous prompt if its similarity
+    is at least `threshold`. Enable with LLM_SEMANTIC_CACHE=1 (requires the optional
+    `sentence-transformers` and `faiss-cpu` packages).
+
+    Only the dynamic prompt is embedded: the shared `cache_prefix` would otherwise
+    fill the model's 256-token window and make every prompt look alike. Instead
+    there is one index per prefix digest, and lookups only match prompts that
+    were sent with the same prefix.
+
+    Entries are persisted as an append-only JSONL file of {"k", "p", "e", "v"} records
+    (exact cache key, prefix digest, embedding, response); the indexes are rebuilt
+    from it on load.
+    Appends and compaction hold an exclusive flock on a sidecar .lock file, so
+    several processes can share the cache without interleaving records.
+    """
+
+    def __init__(self, path_prefix: str, threshold: float, model_name: str = "sentence-transformers/all-MiniLM-L6-v2"):
+        import faiss
+        import numpy as np
+        from sentence_transformers import SentenceTransformer
+
+        self._lock = threading.Lock()
+        self._faiss = faiss
+        self.threshold = threshold
+        self.model = SentenceTransformer(model_name)
+        self.records_file = f"{path_prefix}.jsonl"
+        # prefix digest -> (FAISS index, responses in index order)
+        self.indexes = {}
+        self._lock_file = open(f"{self.records_file}.lock", "a")
+
+        # Stream the log into memory; the last record for a key wins
+        entries = {}
+        line_count = 0
+        bad_lines = 0
+        loaded = True
+        with self._file_lock():
+            if os.path.exists(self.records_file):
+                try:
+                    with open(self.records_file, "rb") as f:
+                        for line in f:
+                            if not line.strip():
+                                continue
+                            line_count += 1
+                            # Skip a torn or corrupt line without losing the rest of the log
+                            try:
+                                record = _json_loads(line)
+                                key, _, _ = record["k"], record["e"], record["v"]
+                            except Exception:
+                                bad_lines += 1
+                                continue
+                            # Records without "p" embedded prefix + prompt and cannot be matched
+                            if "p" in record:
+                                entries[key] = record
+                except OSError as e:
+                    loaded = False
+                    logger.warning(f"Failed to read semantic cache, continuing with {len(entries)} entries: {e}")
+                if bad_lines:
+                    logger.warning(f"Skipped {bad_lines} unreadable line(s) in {self.records_file}")
+            # Compact when superseded records make up more than half of the file; only after a
+            # clean load, so lines that could not be parsed are never rewritten away
+            if loaded and not bad_lines and line_count > 2 * len(entries):
+                self._compact(entries.values())
+        by_prefix = {}
+        for record in entries.values():
+            by_prefix.setdefault(record["p"], []).append(record)
+        for prefix_key, records in by_prefix.items():
+            index, responses = self._index_for(prefix_key)
+            index.add(np.array([r["e"] for r in records], dtype="float32"))
+            responses.extend(r["v"] for r in records)
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        if fcntl is None:
+            yield
+            return
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
 
-# By default, we Google Gemini 2.5 pro, as it shows great performance for code understanding
-def call_llm(prompt: str, use_cache: bool = True) -> str:
-    def get_limit_chars(provider_name: str) -> int:
-        # Allow override
-        env_val = os.getenv("LLM_MAX_PROMPT_CHARS")
-        if env_val:
-            try:
-                return int(env_val)
-            except:
-                pass
-        # Conservative defaults (chars ~ tokens*4)
-        if provider_name == "openai":
-            # 128k tokens -> ~512k chars; keep headroom
-            return 350_000
-        if provider_name == "yandex":
-            # YandexGPT typically supports 8k-32k tokens; use conservative limit
-            return 300_000
-        # Gemini 2.5 models can support very large contexts; keep a high cap
-        return 1_200_000
-
-    def get_chunk_size_chars(provider_name: str) -> int:
-        env_val = os.getenv("LLM_CHUNK_SIZE_CHARS")
-        if env_val:
+    def _compact(self, records) -> None:
+        tmp_file = f"{self.records_file}.tmp"
+        try:
+            with open(tmp_file, "wb") as f:
+                for record in records:
+                    f.write(_json_dumps(record) + b"\n")
+            os.replace(tmp_file, self.records_file)
+        except Exception as e:
+            logger.warning(f"Failed to compact semantic cache: {e}")
+
+    def _index_for(self, prefix_key: str):
+        if prefix_key not in self.indexes:
+            index = self._faiss.IndexFlatIP(self.model.get_sentence_embedding_dimension())
+            self.indexes[prefix_key] = (index, [])
+        return self.indexes[prefix_key]
+
+    @staticmethod
+    def prefix_key(cache_prefix: Optional[str]) -> str:
+        return hashlib.sha256(cache_prefix.encode("utf-8")).hexdigest() if cache_prefix else ""
+
+    def embed(self, prompt: str):
+        return self.model.encode([prompt], normalize_embeddings=True).astype("float32")
+
+    def get(self, prefix_key: str, embedding):
+        with self._lock:
+            if prefix_key not in self.indexes:
+                return None
+            index, responses = self.indexes[prefix_key]
+            scores, ids = index.search(embedding, 1)
+            if scores[0][0] >= self.threshold:
+                return responses[ids[0][0]]
+        return None
+
+    def add(self, key: bytes, prefix_key: str, embedding, response_text: str) -> None:
+        with self._lock:
+            index, responses = self._index_for(prefix_key)
+            index.add(embedding)
+            responses.append(response_text)
+            # One appended line per miss instead of rewriting the whole cache
             try:
-                return int(env_val)
-            except:
-                pass
-        # Keep per-request payloads well under limits
-        if provider_name == "openai":
-            return 120_000
-        if provider_name == "yandex":
-            return 50_000
-        return 300_000
-
-    def summarize_chunks_openai(text: str, client, model: str, max_chars: int) -> str:
-        chunk_size = get_chunk_size_chars("openai")
-        summaries = []
-        instruction = (
-            "You will compress a large, technical context for downstream analysis.\n"
-            "Requirements:\n"
-            "- Preserve key APIs, function/class names, file paths, and important code lines\n"
-            "- Keep crucial semantics; remove boilerplate and repeated sections\n"
-            "- Output concise plain text (no YAML fences)\n"
+                record = {"k": key.hex(), "p": prefix_key, "e": embedding[0].tolist(), "v": response_text}
+                # Reopen under the lock: another process may have compacted (replaced) the file
+                with self._file_lock(), open(self.records_file, "ab") as f:
+                    f.write(_json_dumps(record) + b"\n")
+            except Exception as e:
+                logger.error(f"Failed to save semantic cache: {e}")
+
+
+_semantic_cache = None
+_semantic_cache_lock = threading.Lock()
+
+
+def _get_semantic_cache():
+    """Return the shared SemanticCache, or None if LLM_SEMANTIC_CACHE is not enabled."""
+    global _semantic_cache
+    if os.getenv("LLM_SEMANTIC_CACHE", "0") != "1":
+        return None
+    if _semantic_cache is None:
+        # Map chunks call in from several threads; build the model and index only once
+        with _semantic_cache_lock:
+            if _semantic_cache is None:
+                threshold = float(os.getenv("LLM_SEM_THRESHOLD", "0.92"))
+                path_prefix = f"{os.path.splitext(cache_file)[0]}_semantic"
+                _semantic_cache = SemanticCache(path_prefix, threshold)
+    return _semantic_cache
+
+
+# Gemini explicit context caches, keyed by sha256(model + prefix) -> (cache name or None, expiry time)
+GEMINI_CACHE_TTL_SECONDS = 600
+# Well below the smallest explicit cache Gemini accepts (1024 tokens); skip the doomed create call
+GEMINI_CACHE_MIN_CHARS = 4096
+_gemini_caches = {}
+_gemini_prefixes_seen = set()
+_gemini_caches_lock = threading.Lock()
+
+
+def _gemini_cached_content(client, model: str, cache_prefix: str) -> Optional[str]:
+    """
+    Return the name of a live Gemini context cache holding `cache_prefix`, creating
+    one the second time a prefix is seen. Returns None for a first (possibly only)
+    use, for prefixes too small to cache, and while another thread is creating the
+    cache; callers then send the prefix inline.
+    """
+    if len(cache_prefix) < GEMINI_CACHE_MIN_CHARS:
+        return None
+    key = hashlib.sha256(f"{model}\0{cache_prefix}".encode("utf-8")).digest()
+    with _gemini_caches_lock:
+        now = time.time()
+        entry = _gemini_caches.get(key)
+        # Keep a margin so the cache does not expire between lookup and use
+        if entry and entry[1] > now + 30:
+            return entry[0]
+        # Most nodes send their prefix once; only pay for a cache when it is reused
+        if key not in _gemini_prefixes_seen:
+            _gemini_prefixes_seen.add(key)
+            return None
+        # Claim the creation so concurrent callers go inline instead of creating duplicates
+        _gemini_caches[key] = (None, now + 90)
+    try:
+        cache = client.caches.create(
+            model=model,
+            config=types.CreateCachedContentConfig(
+                contents=[cache_prefix],
+                ttl=f"{GEMINI_CACHE_TTL_SECONDS}s",
+            ),
         )
-        for i in range(0, len(text), chunk_size):
-            chunk = text[i : i + chunk_size]
-            r = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": instruction},
-                    {"role": "user", "content": f"Compress this chunk:\n{chunk}"},
-                ],
-            )
-            summaries.append(r.choices[0].message.content.strip())
-        combined = "\n\n".join(summaries)
-        # Iteratively reduce if still too big
-        reduce_round = 0
-        while len(combined) > max_chars and reduce_round < 3:
-            reduce_round += 1
-            r = client.chat.completions.create(
-                model=model,
-                messages=[
+        name = cache.name
+    except Exception as e:
+        logger.info(f"Gemini context cache not created, sending prefix inline: {e}")
+        name = None
+    with _gemini_caches_lock:
+        _gemini_caches[key] = (name, time.time() + GEMINI_CACHE_TTL_SECONDS)
+    return name
+
+
+# Compression calls for separate chunks are independent, so they run concurrently
+SUMMARIZE_CONCURRENCY = 8
+
+
+def _split_chunks(text: str, chunk_size: int) -> list:
+    return [text[i : i + chunk_size] for i in range(0, len(text), chunk_size)]
+
+
+def _compress_chunks(compress, text: str, chunk_size: int) -> str:
+    """Split `text` into chunk_size pieces, compress them concurrently, and join the results in order."""
+    with ThreadPoolExecutor(max_workers=SUMMARIZE_CONCURRENCY) as executor:
+        return "\n\n".join(executor.map(compress, _split_chunks(text, chunk_size)))
+
+
+# OpenAI Batch API (50% cheaper, asynchronous) for bulk compression passes
+BATCH_MIN_CHUNKS = 4
+BATCH_POLL_SECONDS = 15
+
+
+def _openai_batch_compress(client, model: str, instruction: str, user_contents: list) -> Optional[list]:
+    """
+    Run one chat completion per entry of `user_contents` through the OpenAI Batch API.
+    Returns the responses in input order, or None if the batch fails or does not finish
+    within LLM_BATCH_MAX_WAIT seconds (callers then fall back to synchronous calls).
+    """
+    max_wait = int(os.getenv("LLM_BATCH_MAX_WAIT", "1800"))
+    lines = [
+        _json_dumps({
+            "custom_id": str(i),
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": model,
+                "messages": [
                     {"role": "system", "content": instruction},
-                    {"role": "user", "content": f"Further compress while preserving technical fidelity:\n{combined}"},
+                    {"role": "user", "content": content},
                 ],
-            )
-            combined = r.choices[0].message.content.strip()
-        return combined
-
-    def summarize_chunks_google(text: str, client, model: str, max_chars: int) -> str:
-        chunk_size = get_chunk_size_chars("google")
-        summaries = []
-        instruction = (
-            "You will compress a large, technical context for downstream analysis.\n"
-            "Requirements:\n"
-            "- Preserve key APIs, function/class names, file paths, and important code lines\n"
-            "- Keep crucial semantics; remove boilerplate and repeated sections\n"
-            "- Output concise plain text (no YAML fences)\n"
+            },
+        })
+        for i, content in enumerate(user_contents)
+    ]
+    try:
+        input_file = client.files.create(
+            file=("compress_batch.jsonl", b"\n".join(lines)),
+            purpose="batch",
         )
-        for i in range(0, len(text), chunk_size):
-            chunk = text[i : i + chunk_size]
-            resp = client.models.generate_content(
-                model=model,
-                contents=[instruction, f"Compress this chunk:\n{chunk}"],
-            )
-            summaries.append(resp.text.strip())
-        combined = "\n\n".join(summaries)
-        reduce_round = 0
-        while len(combined) > max_chars and reduce_round < 3:
-            reduce_round += 1
-            resp = client.models.generate_content(
-                model=model,
-                contents=[instruction, f"Further compress while preserving technical fidelity:\n{combined}"],
-            )
-            combined = resp.text.strip()
-        return combined
-
-    def summarize_chunks_yandex(text: str, client, model: str, max_chars: int) -> str:
-        """YandexGPT uses OpenAI-compatible API, so we use the same approach as OpenAI."""
-        chunk_size = get_chunk_size_chars("yandex")
-        summaries = []
-        instruction = (
-            "You are a technical documentation assistant. You will compress a large, technical context for downstream analysis.\n"
-            "Requirements:\n"
-            "- Preserve key APIs, function/class names, file paths, and important code lines\n"
-            "- Keep crucial semantics; remove boilerplate and repeated sections\n"
-            "- Output concise plain text (no YAML fences, no explanatory text)\n"
+        batch = client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
         )
-        for i in range(0, len(text), chunk_size):
-            chunk = text[i : i + chunk_size]
-            r = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": instruction},
-                    {"role": "user", "content": f"Compress this chunk:\n{chunk}"},
-                ],
-            )
-            summaries.append(r.choices[0].message.content.strip())
-        combined = "\n\n".join(summaries)
-        # Iteratively reduce if still too big
-        reduce_round = 0
-        while len(combined) > max_chars and reduce_round < 3:
-            reduce_round += 1
-            r = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": instruction},
-                    {"role": "user", "content": f"Further compress while preserving technical fidelity:\n{combined}"},
-                ],
-            )
-            combined = r.choices[0].message.content.strip()
-        return combined
-
-    # Log the prompt
-    logger.info(f"PROMPT: {prompt}")
-
-    # Check cache if enabled
-    if use_cache:
-        # Load cache from disk
-        cache = {}
-        if os.path.exists(cache_file):
-            try:
-                with open(cache_file, "r", encoding="utf-8") as f:
-                    cache = json.load(f)
-            except:
-                logger.warning(f"Failed to load cache, starting with empty cache")
+        logger.info(f"Submitted OpenAI batch {batch.id} with {len(lines)} compression requests")
+        deadline = time.time() + max_wait
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            if time.time() > deadline:
+                logger.warning(f"OpenAI batch {batch.id} exceeded LLM_BATCH_MAX_WAIT={max_wait}s; cancelling and falling back to sync calls")
+                client.batches.cancel(batch.id)
+                return None
+            time.sleep(BATCH_POLL_SECONDS)
+            batch = client.batches.retrieve(batch.id)
+        if batch.status != "completed" or not batch.output_file_id:
+            logger.warning(f"OpenAI batch {batch.id} ended with status {batch.status}; falling back to sync calls")
+            return None
+        output = client.files.content(batch.output_file_id).content
+    except Exception as e:
+        logger.warning(f"OpenAI batch compression failed, falling back to sync calls: {e}")
+        return None
+
+    results = {}
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        record = _json_loads(line)
+        response = record.get("response") or {}
+        if response.get("status_code") != 200:
+            logger.warning(f"OpenAI batch request {record.get('custom_id')} failed; falling back to sync calls")
+            return None
+        results[record["custom_id"]] = response["body"]["choices"][0]["message"]["content"].strip()
+    if len(results) != len(user_contents):
+        return None
+    return [results[str(i)] for i in range(len(user_contents))]
+
+
+def _get_limit_chars(provider_name: str) -> int:
+    # Allow override
+    env_val = os.getenv("LLM_MAX_PROMPT_CHARS")
+    if env_val:
+        try:
+            return int(env_val)
+        except:
+            pass
+    # Conservative defaults (chars ~ tokens*4)
+    if provider_name == "openai":
+        # 128k tokens -> ~512k chars; keep headroom
+        return 350_000
+    if provider_name == "yandex":
+        # YandexGPT typically supports 8k-32k tokens; use conservative limit
+        return 300_000
+    # Gemini 2.5 models can support very large contexts; keep a high cap
+    return 1_200_000
 
-        # Return from cache if exists
-        if prompt in cache:
-            logger.info(f"RESPONSE: {cache[prompt]}")
-            return cache[prompt]
 
+def _get_chunk_size_chars(provider_name: str) -> int:
+    env_val = os.getenv("LLM_CHUNK_SIZE_CHARS")
+    if env_val:
+        try:
+            return int(env_val)
+        except:
+            pass
+    # Keep per-request payloads well under limits
+    if provider_name == "openai":
+        return 120_000
+    if provider_name == "yandex":
+        return 50_000
+    return 300_000
+
+
+def _get_limit_tokens(provider_name: str) -> Optional[int]:
+    env_val = os.getenv("LLM_MAX_PROMPT_TOKENS")
+    if env_val:
+        try:
+            return int(env_val)
+        except:
+            pass
+    if provider_name == "openai":
+        # 128k context; keep headroom for the response
+        return 120_000
+    if provider_name == "google":
+        # Gemini 2.5 accepts ~1M input tokens
+        return 1_000_000
+    # No tokenizer available for YandexGPT; rely on the char cap
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def _tiktoken_encoding(model: str):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        # The encoding is downloaded on first use; without it fall back to the char cap
+        logger.warning(f"Failed to load tiktoken encoding for {model}: {e}")
+        return None
+
+
+def _count_tokens(config: dict, *texts: Optional[str]) -> Optional[int]:
+    """Exact token count for the provider's model, or None if it cannot be measured."""
+    texts = [t for t in texts if t]
+    if config["provider"] == "openai":
+        encoding = _tiktoken_encoding(config["model"])
+        if encoding is None:
+            return None
+        return sum(len(encoding.encode(t, disallowed_special=())) for t in texts)
+    if config["provider"] == "google":
+        try:
+            return config["client"].models.count_tokens(model=config["model"], contents=texts).total_tokens
+        except Exception as e:
+            logger.warning(f"Failed to count Gemini tokens: {e}")
+    return None
+
+
+def _needs_compression(prompt: str, cache_prefix: Optional[str], config: dict) -> bool:
+    """
+    The char cap is a cheap, conservative first check. Prompts above it are measured in
+    tokens, and only compressed if they really exceed the model's token limit.
+    """
+    prefix_len = len(cache_prefix) if cache_prefix else 0
+    if prefix_len + len(prompt) <= config["max_chars"]:
+        return False
+    if config["max_tokens"] is None:
+        return True
+    n_tokens = _count_tokens(config, cache_prefix, prompt)
+    if n_tokens is None:
+        return True
+    if n_tokens <= config["max_tokens"]:
+        logger.info(f"Prompt length {prefix_len + len(prompt)} chars is {n_tokens} tokens, within ~{config['max_tokens']}; skipping compression")
+        return False
+    return True
+
+
+@functools.lru_cache(maxsize=None)
+def _llm_config() -> dict:
+    """
+    Resolve the provider, client, model and limits once per process.
+
+    Resolved on first call rather than at import, because main.py loads `.env`
+    only after the flow (and this module) have been imported.
+    """
     # Select provider: "openai", "yandex", or default to "google"
     provider = os.getenv("LLM_PROVIDER", "google").lower()
+    config = {}
     if provider == "openai":
         # OpenAI
         # Env:
@@ -187,31 +504,9 @@ def call_llm(prompt: str, use_cache: bool = True) -> str:
         from openai import OpenAI
         from openai import BadRequestError
 
-        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY", ""))
-        model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
-        max_chars = get_limit_chars("openai")
-        effective_prompt = prompt
-        if len(effective_prompt) > max_chars:
-            logger.info(f"Prompt length {len(effective_prompt)} exceeds OpenAI limit ~{max_chars} chars; compressing...")
-            effective_prompt = summarize_chunks_openai(effective_prompt, client, model, max_chars)
-        try:
-            r = client.chat.completions.create(
-                model=model,
-                messages=[{"role": "user", "content": effective_prompt}],
-            )
-            response_text = r.choices[0].message.content
-        except BadRequestError as e:
-            # Fallback if context limit still exceeded due to tokenization overhead
-            if "context length" in str(e).lower():
-                logger.warning("Context length exceeded; applying additional compression and retrying once.")
-                effective_prompt = summarize_chunks_openai(effective_prompt, client, model, max_chars // 2)
-                r = client.chat.completions.create(
-                    model=model,
-                    messages=[{"role": "user", "content": effective_prompt}],
-                )
-                response_text = r.choices[0].message.content
-            else:
-                raise
+        config["client"] = OpenAI(api_key=os.getenv("OPENAI_API_KEY", ""))
+        config["model"] = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+        config["bad_request_error"] = BadRequestError
     elif provider == "yandex":
         # YandexGPT (OpenAI-compatible API)
         # Env:
@@ -225,36 +520,203 @@ def call_llm(prompt: str, use_cache: bool = True) -> str:
         api_key = os.getenv("YANDEX_API_KEY", "")
         folder_id = os.getenv("YANDEX_FOLDER_ID", "")
         base_url = os.getenv("YANDEX_BASE_URL", "https://llm.api.cloud.yandex.net/v1")
-        
+
         if not api_key:
             raise ValueError("YANDEX_API_KEY environment variable is required for YandexGPT")
         if not folder_id:
             raise ValueError("YANDEX_FOLDER_ID environment variable is required for YandexGPT")
-        
-        # Build model URI if not provided
-        model_uri = os.getenv("YANDEX_MODEL_URI", f"gpt://{folder_id}/yandexgpt/latest")
-        
+
         # Initialize OpenAI client with Yandex base URL
-        client = OpenAI(
+        config["client"] = OpenAI(
             api_key=api_key,
             base_url=base_url,
         )
-        
-        model = model_uri
-        max_chars = get_limit_chars("yandex")
-        effective_prompt = prompt
-        if len(effective_prompt) > max_chars:
-            logger.info(f"Prompt length {len(effective_prompt)} exceeds YandexGPT limit ~{max_chars} chars; compressing...")
-            effective_prompt = summarize_chunks_yandex(effective_prompt, client, model, max_chars)
-        try:
-            # Add system message to enforce structured output for YandexGPT
-            system_message = (
-                "You are a technical documentation assistant. You MUST follow instructions precisely and output "
-                "structured data in the exact format requested (YAML, JSON, etc.). Do not add explanatory text "
-                "outside the requested format. If the instruction asks for a YAML list, output ONLY a valid YAML list "
-                "(array) starting with dashes. If the instruction asks for a YAML dictionary, output ONLY a valid YAML dictionary. "
-                "Never output plain text descriptions instead of structured data."
+        # Build model URI if not provided
+        config["model"] = os.getenv("YANDEX_MODEL_URI", f"gpt://{folder_id}/yandexgpt/latest")
+        config["bad_request_error"] = BadRequestError
+    else:
+        # Google Gemini (AI Studio key)
+        provider = "google"
+        config["client"] = genai.Client(
+            api_key=os.getenv("GEMINI_API_KEY", ""),
+        )
+        # config["model"] = os.getenv("GEMINI_MODEL", "gemini-2.5-pro")
+        config["model"] = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+    config["provider"] = provider
+    config["max_chars"] = _get_limit_chars(provider)
+    config["chunk_size"] = _get_chunk_size_chars(provider)
+    config["max_tokens"] = _get_limit_tokens(provider)
+    return config
+
+
+def _summarize_chunks_openai(text: str, config: dict, max_chars: int) -> str:
+    client, model, chunk_size = config["client"], config["model"], config["chunk_size"]
+    instruction = (
+        "You will compress a large, technical context for downstream analysis.\n"
+        "Requirements:\n"
+        "- Preserve key APIs, function/class names, file paths, and important code lines\n"
+        "- Keep crucial semantics; remove boilerplate and repeated sections\n"
+        "- Output concise plain text (no YAML fences)\n"
+    )
+
+    def compress(user_content: str) -> str:
+        r = client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": instruction},
+                {"role": "user", "content": user_content},
+            ],
+        )
+        return r.choices[0].message.content.strip()
+
+    # Latency-tolerant bulk passes can go through the Batch API at half the token price
+    summaries = None
+    chunks = _split_chunks(text, chunk_size)
+    if len(chunks) >= BATCH_MIN_CHUNKS and os.getenv("LLM_ALLOW_BATCH", "0") == "1":
+        summaries = _openai_batch_compress(
+            client, model, instruction, [f"Compress this chunk:\n{chunk}" for chunk in chunks]
+        )
+    if summaries is not None:
+        combined = "\n\n".join(summaries)
+    else:
+        combined = _compress_chunks(lambda chunk: compress(f"Compress this chunk:\n{chunk}"), text, chunk_size)
+    # Iteratively reduce if still too big (sub-chunks are compressed in parallel too)
+    reduce_round = 0
+    while len(combined) > max_chars and reduce_round < 3:
+        reduce_round += 1
+        combined = _compress_chunks(
+            lambda chunk: compress(f"Further compress while preserving technical fidelity:\n{chunk}"),
+            combined,
+            chunk_size,
+        )
+    return combined
+
+
+def _summarize_chunks_google(text: str, config: dict, max_chars: int) -> str:
+    client, model, chunk_size = config["client"], config["model"], config["chunk_size"]
+    instruction = (
+        "You will compress a large, technical context for downstream analysis.\n"
+        "Requirements:\n"
+        "- Preserve key APIs, function/class names, file paths, and important code lines\n"
+        "- Keep crucial semantics; remove boilerplate and repeated sections\n"
+        "- Output concise plain text (no YAML fences)\n"
+    )
+
+    def compress(user_content: str) -> str:
+        resp = client.models.generate_content(
+            model=model,
+            contents=[instruction, user_content],
+        )
+        return resp.text.strip()
+
+    combined = _compress_chunks(lambda chunk: compress(f"Compress this chunk:\n{chunk}"), text, chunk_size)
+    reduce_round = 0
+    while len(combined) > max_chars and reduce_round < 3:
+        reduce_round += 1
+        combined = _compress_chunks(
+            lambda chunk: compress(f"Further compress while preserving technical fidelity:\n{chunk}"),
+            combined,
+            chunk_size,
+        )
+    return combined
+
+
+def _summarize_chunks_yandex(text: str, config: dict, max_chars: int) -> str:
+    """YandexGPT uses OpenAI-compatible API, so we use the same approach as OpenAI."""
+    client, model, chunk_size = config["client"], config["model"], config["chunk_size"]
+    instruction = (
+        "You are a technical documentation assistant. You will compress a large, technical context for downstream analysis.\n"
+        "Requirements:\n"
+        "- Preserve key APIs, function/class names, file paths, and important code lines\n"
+        "- Keep crucial semantics; remove boilerplate and repeated sections\n"
+        "- Output concise plain text (no YAML fences, no explanatory text)\n"
+    )
+
+    def compress(user_content: str) -> str:
+        r = client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": instruction},
+                {"role": "user", "content": user_content},
+            ],
+        )
+        return r.choices[0].message.content.strip()
+
+    combined = _compress_chunks(lambda chunk: compress(f"Compress this chunk:\n{chunk}"), text, chunk_size)
+    # Iteratively reduce if still too big (sub-chunks are compressed in parallel too)
+    reduce_round = 0
+    while len(combined) > max_chars and reduce_round < 3:
+        reduce_round += 1
+        combined = _compress_chunks(
+            lambda chunk: compress(f"Further compress while preserving technical fidelity:\n{chunk}"),
+            combined,
+            chunk_size,
+        )
+    return combined
+
+
+def _call_openai(prompt: str, cache_prefix: Optional[str], config: dict) -> str:
+    client, model, max_chars = config["client"], config["model"], config["max_chars"]
+    prefix_len = len(cache_prefix) if cache_prefix else 0
+    effective_prompt = prompt
+    if _needs_compression(effective_prompt, cache_prefix, config):
+        logger.info(f"Prompt length {prefix_len + len(effective_prompt)} exceeds OpenAI limit ~{max_chars} chars; compressing...")
+        effective_prompt = _summarize_chunks_openai(effective_prompt, config, max_chars - prefix_len)
+    # Static prefix goes in the system message so OpenAI's automatic prompt caching can reuse it
+    prefix_messages = [{"role": "system", "content": cache_prefix}] if cache_prefix else []
+    try:
+        r = client.chat.completions.create(
+            model=model,
+            messages=prefix_messages + [{"role": "user", "content": effective_prompt}],
+        )
+        return r.choices[0].message.content
+    except config["bad_request_error"] as e:
+        # Fallback if context limit still exceeded due to tokenization overhead
+        if "context length" in str(e).lower():
+            logger.warning("Context length exceeded; applying additional compression and retrying once.")
+            effective_prompt = _summarize_chunks_openai(effective_prompt, config, (max_chars - prefix_len) // 2)
+            r = client.chat.completions.create(
+                model=model,
+                messages=prefix_messages + [{"role": "user", "content": effective_prompt}],
             )
+            return r.choices[0].message.content
+        raise
+
+
+# Added to every YandexGPT request to enforce structured output
+YANDEX_SYSTEM_MESSAGE = (
+    "You are a technical documentation assistant. You MUST follow instructions precisely and output "
+    "structured data in the exact format requested (YAML, JSON, etc.). Do not add explanatory text "
+    "outside the requested format. If the instruction asks for a YAML list, output ONLY a valid YAML list "
+    "(array) starting with dashes. If the instruction asks for a YAML dictionary, output ONLY a valid YAML dictionary. "
+    "Never output plain text descriptions instead of structured data."
+)
+
+
+def _call_yandex(prompt: str, cache_prefix: Optional[str], config: dict) -> str:
+    client, model, max_chars = config["client"], config["model"], config["max_chars"]
+    prefix_len = len(cache_prefix) if cache_prefix else 0
+    effective_prompt = prompt
+    if _needs_compression(effective_prompt, cache_prefix, config):
+        logger.info(f"Prompt length {prefix_len + len(effective_prompt)} exceeds YandexGPT limit ~{max_chars} chars; compressing...")
+        effective_prompt = _summarize_chunks_yandex(effective_prompt, config, max_chars - prefix_len)
+    system_message = YANDEX_SYSTEM_MESSAGE
+    if cache_prefix:
+        system_message = f"{system_message}\n\n{cache_prefix}"
+    try:
+        r = client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": system_message},
+                {"role": "user", "content": effective_prompt}
+            ],
+        )
+        return r.choices[0].message.content
+    except config["bad_request_error"] as e:
+        # Fallback if context limit still exceeded due to tokenization overhead
+        if "context length" in str(e).lower() or "token" in str(e).lower():
+            logger.warning("Context length exceeded; applying additional compression and retrying once.")
+            effective_prompt = _summarize_chunks_yandex(effective_prompt, config, (max_chars - prefix_len) // 2)
             r = client.chat.completions.create(
                 model=model,
                 messages=[
@@ -262,65 +724,88 @@ def call_llm(prompt: str, use_cache: bool = True) -> str:
                     {"role": "user", "content": effective_prompt}
                 ],
             )
-            response_text = r.choices[0].message.content
-        except BadRequestError as e:
-            # Fallback if context limit still exceeded due to tokenization overhead
-            if "context length" in str(e).lower() or "token" in str(e).lower():
-                logger.warning("Context length exceeded; applying additional compression and retrying once.")
-                effective_prompt = summarize_chunks_yandex(effective_prompt, client, model, max_chars // 2)
-                system_message = (
-                    "You are a technical documentation assistant. You MUST follow instructions precisely and output "
-                    "structured data in the exact format requested (YAML, JSON, etc.). Do not add explanatory text "
-                    "outside the requested format. If the instruction asks for a YAML list, output ONLY a valid YAML list "
-                    "(array) starting with dashes. If the instruction asks for a YAML dictionary, output ONLY a valid YAML dictionary. "
-                    "Never output plain text descriptions instead of structured data."
-                )
-                r = client.chat.completions.create(
-                    model=model,
-                    messages=[
-                        {"role": "system", "content": system_message},
-                        {"role": "user", "content": effective_prompt}
-                    ],
-                )
-                response_text = r.choices[0].message.content
-            else:
-                raise
-    else:
-        # Google Gemini (AI Studio key)
-        client = genai.Client(
-            api_key=os.getenv("GEMINI_API_KEY", ""),
+            return r.choices[0].message.content
+        raise
+
+
+def _call_google(prompt: str, cache_prefix: Optional[str], config: dict) -> str:
+    client, model, max_chars = config["client"], config["model"], config["max_chars"]
+    prefix_len = len(cache_prefix) if cache_prefix else 0
+    effective_prompt = prompt
+    if _needs_compression(effective_prompt, cache_prefix, config):
+        logger.info(f"Prompt length {prefix_len + len(effective_prompt)} exceeds Gemini safe cap ~{max_chars} chars; compressing...")
+        effective_prompt = _summarize_chunks_google(effective_prompt, config, max_chars - prefix_len)
+    cached_content = _gemini_cached_content(client, model, cache_prefix) if cache_prefix else None
+    if cached_content:
+        response = client.models.generate_content(
+            model=model,
+            contents=[effective_prompt],
+            config=types.GenerateContentConfig(cached_content=cached_content),
         )
-        # model = os.getenv("GEMINI_MODEL", "gemini-2.5-pro")
-        model = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
-        max_chars = get_limit_chars("google")
-        effective_prompt = prompt
-        if len(effective_prompt) > max_chars:
-            logger.info(f"Prompt length {len(effective_prompt)} exceeds Gemini safe cap ~{max_chars} chars; compressing...")
-            effective_prompt = summarize_chunks_google(effective_prompt, client, model, max_chars)
-        response = client.models.generate_content(model=model, contents=[effective_prompt])
-        response_text = response.text
+    else:
+        # Prefix first so Gemini's implicit prefix caching can still apply
+        contents = [cache_prefix, effective_prompt] if cache_prefix else [effective_prompt]
+        response = client.models.generate_content(model=model, contents=contents)
+    return response.text
+
+
+_DISPATCH = {
+    "openai": _call_openai,
+    "yandex": _call_yandex,
+    "google": _call_google,
+}
+
+
+# By default, we Google Gemini 2.5 pro, as it shows great performance for code understanding
+def call_llm(prompt: str, use_cache: bool = True, *, cache_prefix: Optional[str] = None) -> str:
+    """
+    Call the configured LLM provider.
+
+    `cache_prefix` holds static instructions shared across many calls. It is sent
+    ahead of `prompt` in a provider-cacheable position (system message for OpenAI,
+    explicit context cache for Gemini) so repeated calls reuse the cached prefix.
+    """
+    # Log the prompt
+    if cache_prefix:
+        logger.info(f"PROMPT PREFIX: {cache_prefix}")
+    logger.info(f"PROMPT: {prompt}")
+
+    # Check cache if enabled
+    if use_cache:
+        cache_key = _cache_key(prompt, cache_prefix)
+        try:
+            cached = _cache_get(cache_key)
+            logger.info(f"RESPONSE: {cached}")
+            return cached
+        except KeyError:
+            pass
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to read cache: {e}")
+
+        # Fall back to near-duplicate lookup if enabled
+        semantic_cache = _get_semantic_cache()
+        if semantic_cache is not None:
+            prefix_key = SemanticCache.prefix_key(cache_prefix)
+            prompt_embedding = semantic_cache.embed(prompt)
+            cached = semantic_cache.get(prefix_key, prompt_embedding)
+            if cached is not None:
+                logger.info(f"RESPONSE (semantic cache): {cached}")
+                return cached
+
+    config = _llm_config()
+    response_text = _DISPATCH[config["provider"]](prompt, cache_prefix, config)
 
     # Log the response
     logger.info(f"RESPONSE: {response_text}")
 
     # Update cache if enabled
     if use_cache:
-        # Load cache again to avoid overwrites
-        cache = {}
-        if os.path.exists(cache_file):
-            try:
-                with open(cache_file, "r", encoding="utf-8") as f:
-                    cache = json.load(f)
-            except:
-                pass
-
-        # Add to cache and save
-        cache[prompt] = response_text
         try:
-            with open(cache_file, "w", encoding="utf-8") as f:
-                json.dump(cache, f)
-        except Exception as e:
+            _cache_put(cache_key, response_text)
+        except sqlite3.Error as e:
             logger.error(f"Failed to save cache: {e}")
+        if semantic_cache is not None:
+            semantic_cache.add(cache_key, prefix_key, prompt_embedding, response_text)
 
     return response_text
 
@@ -393,19 +878,15 @@ def call_llm(prompt: str, use_cache: bool = True) -> str:
 
 #     # Check cache if enabled
 #     if use_cache:
-#         # Load cache from disk
-#         cache = {}
-#         if os.path.exists(cache_file):
-#             try:
-#                 with open(cache_file, "r", encoding="utf-8") as f:
-#                     cache = json.load(f)
-#             except:
-#                 logger.warning(f"Failed to load cache, starting with empty cache")
-
-#         # Return from cache if exists
-#         if prompt in cache:
-#             logger.info(f"RESPONSE: {cache[prompt]}")
-#             return cache[prompt]
+#         cache_key = _cache_key(prompt)
+#         try:
+#             cached = _cache_get(cache_key)
+#             logger.info(f"RESPONSE: {cached}")
+#             return cached
+#         except KeyError:
+#             pass
+#         except sqlite3.Error as e:
+#             logger.warning(f"Failed to read cache: {e}")
 
 #     # OpenRouter API configuration
 #     api_key = os.getenv("OPENROUTER_API_KEY", "")
@@ -443,21 +924,9 @@ def call_llm(prompt: str, use_cache: bool = True) -> str:
 
 #     # Update cache if enabled
 #     if use_cache:
-#         # Load cache again to avoid overwrites
-#         cache = {}
-#         if os.path.exists(cache_file):
-#             try:
-#                 with open(cache_file, "r", encoding="utf-8") as f:
-#                     cache = json.load(f)
-#             except:
-#                 pass
-
-#         # Add to cache and save
-#         cache[prompt] = response_text
 #         try:
-#             with open(cache_file, "w", encoding="utf-8") as f:
-#                 json.dump(cache, f)
-#         except Exception as e:
+#             _cache_put(cache_key, response_text)
+#         except sqlite3.Error as e:
 #             logger.error(f"Failed to save cache: {e}")
 
 #     return response_text
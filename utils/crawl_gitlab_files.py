@@ -6,12 +6,57 @@ Uses the same interface as crawl_github_files for consistency.
 """
 
 import os
+import re
 import time
 import fnmatch
+import tempfile
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from typing import Union, Set, List, Dict, Any
 from urllib.parse import urlparse, quote
 
+# Raw-file downloads are network-bound, so fetch them concurrently over a shared connection pool
+DOWNLOAD_WORKERS = 16
+# Tree pages 2..N are fetched in parallel once the first page reports X-Total-Pages
+TREE_PAGE_WORKERS = 8
+TREE_PER_PAGE = 100
+# Blobs are fetched in batches through GraphQL; REST per-file is the fallback.
+# Sizes are queried first so rawBlob is only requested for files under max_file_size.
+GRAPHQL_BATCH_SIZE = 100
+BLOB_SIZES_QUERY = """
+query($fullPath: ID!, $paths: [String!]!, $ref: String) {
+  project(fullPath: $fullPath) {
+    repository {
+      blobs(paths: $paths, ref: $ref) {
+        nodes { path size }
+      }
+    }
+  }
+}
+"""
+BLOBS_QUERY = """
+query($fullPath: ID!, $paths: [String!]!, $ref: String) {
+  project(fullPath: $fullPath) {
+    repository {
+      blobs(paths: $paths, ref: $ref) {
+        nodes { path rawBlob size }
+      }
+    }
+  }
+}
+"""
+# Git blob ids (SHA-1 or SHA-256); anything else is never used as a blob store file name
+BLOB_ID_RE = re.compile(r"[0-9a-f]{40}|[0-9a-f]{64}")
+
+
+def _compile_patterns(patterns):
+    """Compile a set of glob patterns into a single regex, or None if there are none."""
+    if not patterns:
+        return None
+    return re.compile("|".join(fnmatch.translate(p) for p in patterns))
+
 
 def crawl_gitlab_files(
     repo_url: str,
@@ -36,25 +81,19 @@ def crawl_gitlab_files(
 
     Returns:
         dict: {"files": {path: content}, "stats": {...}}
+
+    File contents are cached on disk by git blob id (GITLAB_BLOB_STORE, default
+    "blob_store"), so later runs only download files that changed.
     """
     if include_patterns and isinstance(include_patterns, str):
         include_patterns = {include_patterns}
     if exclude_patterns and isinstance(exclude_patterns, str):
         exclude_patterns = {exclude_patterns}
 
-    def should_include_file(file_path: str, file_name: str) -> bool:
-        if not include_patterns:
-            include_file = True
-        else:
-            include_file = any(
-                fnmatch.fnmatch(file_name, p) for p in include_patterns
-            )
-        if exclude_patterns and include_file:
-            exclude_file = any(
-                fnmatch.fnmatch(file_path, p) for p in exclude_patterns
-            )
-            return not exclude_file
-        return include_file
+    # Globs are translated once up front instead of on every fnmatch call.
+    # The regexes are case-sensitive, like fnmatchcase (no per-call os.path.normcase).
+    include_re = _compile_patterns(include_patterns)
+    exclude_re = _compile_patterns(exclude_patterns)
 
     parsed = urlparse(repo_url)
     host = parsed.netloc or "gitlab.com"
@@ -83,97 +122,286 @@ def crawl_gitlab_files(
 
     project_id_encoded = quote(project_path, safe="")
     api_base = f"https://{host}/api/v4"
-    if not repo_url.startswith("http"):
-        api_base = f"https://{host}/api/v4"
 
     headers = {}
     if token:
         headers["PRIVATE-TOKEN"] = token
 
-    # 1) List repository tree (recursive)
-    tree_url = f"{api_base}/projects/{project_id_encoded}/repository/tree"
-    params = {"recursive": "true", "ref": ref, "per_page": 100}
-    all_items = []
-    page = 1
-    while True:
-        params["page"] = page
-        r = requests.get(tree_url, headers=headers, params=params, timeout=(30, 30))
-        if r.status_code == 401:
-            print(
-                "GitLab 401: Invalid or missing token. Set GITLAB_TOKEN for private repos."
-            )
-            return {"files": {}, "stats": {"error": "Unauthorized"}}
-        if r.status_code == 404:
-            print(
-                "GitLab 404: Project not found or no access. Check URL and token."
-            )
-            return {"files": {}, "stats": {"error": "Not found"}}
-        if r.status_code == 429:
-            wait = int(r.headers.get("Retry-After", 60))
-            print(f"GitLab rate limit. Waiting {wait}s...")
-            time.sleep(wait)
-            continue
-        if r.status_code != 200:
-            print(f"GitLab tree API error: {r.status_code} - {r.text[:500]}")
-            return {"files": {}, "stats": {"error": r.text[:200]}}
+    # One pooled session for tree, GraphQL and raw endpoints (keep-alive + TLS session reuse).
+    # Transient 5xx/429 are retried with backoff; raise_on_status=False hands the final
+    # response back so the status handling below still applies.
+    with requests.Session() as session:
+        session.headers.update(headers)
+        retry = Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504],
+            raise_on_status=False,
+        )
+        session.mount(
+            "https://", HTTPAdapter(pool_connections=1, pool_maxsize=32, max_retries=retry)
+        )
+
+        # 1) List repository tree (recursive)
+        tree_url = f"{api_base}/projects/{project_id_encoded}/repository/tree"
+        params = {"recursive": "true", "ref": ref, "per_page": TREE_PER_PAGE}
+
+        def fetch_tree_page(page):
+            """Fetch one tree page. Returns (response, error_result); error_result is None on success."""
+            while True:
+                r = session.get(tree_url, params={**params, "page": page}, timeout=(30, 30))
+                if r.status_code == 401:
+                    print(
+                        "GitLab 401: Invalid or missing token. Set GITLAB_TOKEN for private repos."
+                    )
+                    return r, {"files": {}, "stats": {"error": "Unauthorized"}}
+                if r.status_code == 404:
+                    print(
+                        "GitLab 404: Project not found or no access. Check URL and token."
+                    )
+                    return r, {"files": {}, "stats": {"error": "Not found"}}
+                if r.status_code == 429:
+                    wait = int(r.headers.get("Retry-After", 60))
+                    print(f"GitLab rate limit. Waiting {wait}s...")
+                    time.sleep(wait)
+                    continue
+                if r.status_code != 200:
+                    print(f"GitLab tree API error: {r.status_code} - {r.text[:500]}")
+                    return r, {"files": {}, "stats": {"error": r.text[:200]}}
+                return r, None
+
+        # 2) Collect blob paths (files only) page by page, so each page's full JSON
+        #    entries can be dropped as soon as the few fields we need are extracted
+        blob_paths = []
 
+        def collect_blobs(data):
+            for item in data:
+                if item.get("type") != "blob":
+                    continue
+                # Include patterns match the basename, so test them before any path work
+                if include_re is not None and not include_re.match(item.get("name", "")):
+                    continue
+                path_item = item.get("path", "")
+                if use_relative_paths and specific_path and path_item.startswith(specific_path):
+                    rel = path_item[len(specific_path) :].lstrip("/")
+                else:
+                    rel = path_item
+                if exclude_re is not None and exclude_re.match(rel):
+                    continue
+                oid = item.get("id")
+                if not isinstance(oid, str) or not BLOB_ID_RE.fullmatch(oid):
+                    oid = None  # never read or write the store for it
+                blob_paths.append((path_item, rel, oid))
+
+        r, error = fetch_tree_page(1)
+        if error:
+            return error
         data = r.json()
-        if not data:
-            break
-        all_items.extend(data)
-        if len(data) < 100:
-            break
-        page += 1
-
-    # 2) Collect blob paths (files only)
-    blob_paths = []
-    for item in all_items:
-        if item.get("type") != "blob":
-            continue
-        path_item = item.get("path", "")
-        if use_relative_paths and specific_path and path_item.startswith(specific_path):
-            rel = path_item[len(specific_path) :].lstrip("/")
+        collect_blobs(data)
+        total_pages = r.headers.get("X-Total-Pages")
+        if total_pages:
+            # Page count is known up front, so fetch the remaining pages in parallel;
+            # pages are filtered as they arrive, in order
+            with ThreadPoolExecutor(max_workers=TREE_PAGE_WORKERS) as executor:
+                for r, error in executor.map(fetch_tree_page, range(2, int(total_pages) + 1)):
+                    if error:
+                        return error
+                    collect_blobs(r.json())
         else:
-            rel = path_item
-        if not should_include_file(rel, item.get("name", "")):
-            continue
-        blob_paths.append((path_item, rel))
-
-    # 3) Fetch raw content for each file
-    files = {}
-    skipped_files = []
-    for path_item, rel_path in blob_paths:
-        file_path_encoded = quote(path_item, safe="")
-        raw_url = (
-            f"{api_base}/projects/{project_id_encoded}/repository/files/{file_path_encoded}/raw"
-        )
-        r = requests.get(
-            raw_url, headers=headers, params={"ref": ref}, timeout=(30, 30)
-        )
-        if r.status_code != 200:
-            print(f"Skip {rel_path}: HTTP {r.status_code}")
-            skipped_files.append((rel_path, 0))
-            continue
-        content = r.text
-        size = len(content.encode("utf-8"))
-        if size > max_file_size:
-            skipped_files.append((rel_path, size))
-            print(f"Skipping {rel_path}: size {size} exceeds limit {max_file_size}")
-            continue
-        files[rel_path] = content
-        print(f"Downloaded: {rel_path} ({size} bytes)")
-
-    return {
-        "files": files,
-        "stats": {
-            "downloaded_count": len(files),
-            "skipped_count": len(skipped_files),
-            "skipped_files": skipped_files,
-            "base_path": specific_path if use_relative_paths else None,
-            "include_patterns": include_patterns,
-            "exclude_patterns": exclude_patterns,
-        },
-    }
+            # GitLab omits X-Total-Pages for very large trees; walk pages until a partial one
+            page = 1
+            while len(data) == TREE_PER_PAGE:
+                page += 1
+                r, error = fetch_tree_page(page)
+                if error:
+                    return error
+                data = r.json()
+                collect_blobs(data)
+
+        # 3) Fetch file contents: local blob store first, then GraphQL batches, REST per-file fallback
+        blob_store = os.getenv("GITLAB_BLOB_STORE", "blob_store")
+
+        def read_stored_blob(oid):
+            """Return (content, size) of a blob cached under its git id, or None if not cached."""
+            if not oid:
+                return None
+            stored_path = os.path.join(blob_store, oid)
+            try:
+                size = os.path.getsize(stored_path)
+                if size > max_file_size:
+                    return None, size
+                # newline="" keeps CRLF files byte-identical to a fresh download
+                with open(stored_path, "r", encoding="utf-8", newline="") as f:
+                    return f.read(), size
+            except OSError:
+                return None
+
+        def store_blob(oid, content):
+            # Blob ids are content hashes, so an entry never goes stale; write atomically
+            tmp_path = None
+            try:
+                os.makedirs(blob_store, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=blob_store)
+                with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+                    f.write(content)
+                os.replace(tmp_path, os.path.join(blob_store, oid))
+            except (OSError, UnicodeError) as e:
+                print(f"Could not store blob {oid}: {e}")
+                if tmp_path is not None:
+                    try:
+                        os.remove(tmp_path)
+                    except OSError:
+                        pass
+
+        def fetch_file(blob):
+            """Download one file. Returns (path_item, content or None if skipped, size)."""
+            path_item, rel_path, _ = blob
+            file_path_encoded = quote(path_item, safe="")
+            raw_url = (
+                f"{api_base}/projects/{project_id_encoded}/repository/files/{file_path_encoded}/raw"
+            )
+            while True:
+                r = session.get(raw_url, params={"ref": ref}, timeout=(30, 30), stream=True)
+                if r.status_code != 429:
+                    break
+                r.close()
+                wait = int(r.headers.get("Retry-After", 60))
+                print(f"GitLab rate limit on {rel_path}. Waiting {wait}s...")
+                time.sleep(wait)
+            with r:
+                if r.status_code != 200:
+                    print(f"Skip {rel_path}: HTTP {r.status_code}")
+                    return path_item, None, 0
+                # Measure bytes on the wire and stop before downloading anything over the cap
+                size = int(r.headers.get("Content-Length") or 0)
+                if size > max_file_size:
+                    print(f"Skipping {rel_path}: size {size} exceeds limit {max_file_size}")
+                    return path_item, None, size
+                chunks = []
+                size = 0
+                for chunk in r.iter_content(chunk_size=64 * 1024):
+                    size += len(chunk)
+                    if size > max_file_size:
+                        print(f"Skipping {rel_path}: size exceeds limit {max_file_size}")
+                        return path_item, None, size
+                    chunks.append(chunk)
+            content = b"".join(chunks).decode("utf-8", errors="replace")
+            print(f"Downloaded: {rel_path} ({size} bytes)")
+            return path_item, content, size
+
+        graphql_url = f"https://{host}/api/graphql"
+        graphql_headers = {"Authorization": f"Bearer {token}"} if token else {}
+
+        def query_blobs_graphql(query, paths):
+            """Run one blobs query over `paths`. Returns {path: node}, or None on any error."""
+            variables = {
+                "fullPath": project_path,
+                "paths": paths,
+                # "HEAD" is not a ref GraphQL accepts; omitting it selects the default branch
+                "ref": None if ref == "HEAD" else ref,
+            }
+            try:
+                r = session.post(
+                    graphql_url,
+                    json={"query": query, "variables": variables},
+                    headers=graphql_headers,
+                    timeout=(30, 60),
+                )
+                payload = r.json() if r.status_code == 200 else {}
+            except (requests.RequestException, ValueError) as e:
+                print(f"GitLab GraphQL request failed ({e}); falling back to REST")
+                return None
+            repository = ((payload.get("data") or {}).get("project") or {}).get("repository")
+            if payload.get("errors") or not repository:
+                print(f"GitLab GraphQL error (HTTP {r.status_code}); falling back to REST")
+                return None
+            return {node["path"]: node for node in repository["blobs"]["nodes"]}
+
+        def fetch_batch_graphql(batch):
+            """
+            Fetch a batch of blobs: sizes first, then content only for files under the cap,
+            so oversized files are never downloaded. Returns {path: node}, or None on error.
+            Oversized nodes carry only `size`; paths missing from the result go to REST.
+            """
+            sizes = query_blobs_graphql(BLOB_SIZES_QUERY, [path_item for path_item, _, _ in batch])
+            if sizes is None:
+                return None
+            nodes = {p: n for p, n in sizes.items() if int(n.get("size") or 0) > max_file_size}
+            wanted = [p for p in sizes if p not in nodes]
+            if wanted:
+                contents = query_blobs_graphql(BLOBS_QUERY, wanted)
+                if contents is not None:
+                    nodes.update(contents)
+            return nodes
+
+        # Keyed by repository path: with use_relative_paths, two paths can share a rel_path
+        results = {}  # path_item -> (content or None if skipped, size)
+        to_fetch = []
+        for blob in blob_paths:
+            path_item, rel_path, oid = blob
+            stored = read_stored_blob(oid)
+            if stored is None:
+                to_fetch.append(blob)
+                continue
+            content, size = stored
+            if content is None:
+                print(f"Skipping {rel_path}: size {size} exceeds limit {max_file_size}")
+            else:
+                print(f"Cached: {rel_path} ({size} bytes)")
+            results[path_item] = stored
+
+        rest_blobs = []
+        batches = [
+            to_fetch[i : i + GRAPHQL_BATCH_SIZE]
+            for i in range(0, len(to_fetch), GRAPHQL_BATCH_SIZE)
+        ]
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+            for batch, nodes in zip(batches, executor.map(fetch_batch_graphql, batches)):
+                for blob in batch:
+                    path_item, rel_path, _ = blob
+                    node = nodes.get(path_item) if nodes is not None else None
+                    if node is None:
+                        rest_blobs.append(blob)
+                        continue
+                    size = int(node.get("size") or 0)
+                    if size > max_file_size:
+                        print(f"Skipping {rel_path}: size {size} exceeds limit {max_file_size}")
+                        results[path_item] = (None, size)
+                        continue
+                    if node.get("rawBlob") is None:
+                        rest_blobs.append(blob)
+                        continue
+                    results[path_item] = (node["rawBlob"], size)
+                    print(f"Downloaded: {rel_path} ({size} bytes)")
+            for path_item, content, size in executor.map(fetch_file, rest_blobs):
+                results[path_item] = (content, size)
+
+        for path_item, _, oid in to_fetch:
+            content = results[path_item][0]
+            if content is not None and oid:
+                store_blob(oid, content)
+
+        # Assemble in blob order so the result shape matches the sequential version
+        files = {}
+        skipped_files = []
+        for path_item, rel_path, _ in blob_paths:
+            content, size = results[path_item]
+            if content is None:
+                skipped_files.append((rel_path, size))
+            else:
+                files[rel_path] = content
+
+        return {
+            "files": files,
+            "stats": {
+                "downloaded_count": len(files),
+                "skipped_count": len(skipped_files),
+                "skipped_files": skipped_files,
+                "base_path": specific_path if use_relative_paths else None,
+                "include_patterns": include_patterns,
+                "exclude_patterns": exclude_patterns,
+            },
+        }
 
 
 if __name__ == "__main__":